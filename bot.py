@@ -2,20 +2,21 @@
 Telegram-бот для мониторинга QA-вакансий.
 """
 
-from typing import Optional,Dict,Any, List
+from typing import Optional, Dict,Any, List, Tuple
 
-import json
+import heapq
 import os
+import random
 import sys
 import threading
 import time
 
-import urllib.parse
-from urllib.request import Request, urlopen
+from concurrent.futures import ThreadPoolExecutor
 
 from conf import (MIN_DISK_SPACE_MB,
                   STATE_FILE_MAX_SIZE,
                   SUBSCRIPTIONS_FILE,
+                  SCHEDULER_WORKERS,
                   AVITO_URL)
 import conf
 
@@ -26,53 +27,56 @@ from util import (register_signal_handlers,
                   check_state_file_size)
 
 
-from search_qa import  monitor,send_telegram_message
+from search_qa import  monitor
+from telegram_api import telegram_api_call, send_telegram_message
+from vacancy_scraper import MonitorResult
 
 from bot_state import (BotState,
                        load_state,
                        save_state,
+                       force_save_state,
+                       start_state_flusher,
+                       journal_append,
+                       schedule_chat,
                        create_empty_state)
 
 register_signal_handlers()
 load_env_variables()
 
+# Сбор сводки и рассылка по расписанию выполняются здесь, а не в scheduler_loop
+_EXEC = ThreadPoolExecutor(max_workers=SCHEDULER_WORKERS, thread_name_prefix="scheduler")
 
-def telegram_api_call(token: str,
-                      method: str,
-                      params: Optional[Dict[str, Any]] = None,
-                      timeout: int = 60) -> Dict[str, Any]:
-    """Вызов Telegram Bot API с обработкой shutdown"""
-    if conf._shutdown_requested:
-        return {"ok": False, "error": "shutdown"}
-    
-    base = f"https://api.telegram.org/bot{token}/{method}"
-    url = base
-    data_bytes = None
-    headers = {}
-    
-    if params:
-        if method == "getUpdates":
-            qs = urllib.parse.urlencode(params)
-            url = f"{base}?{qs}"
-        else:        
-            data_bytes = urllib.parse.urlencode(params).encode("utf-8")
-            headers["Content-Type"] = "application/x-www-form-urlencoded"
-            
-    req = Request(url, data=data_bytes, method="POST" if data_bytes else "GET")
-    for k, v in headers.items():
-        req.add_header(k, v)
-        
-    try:
-        with urlopen(req, timeout=timeout) as resp:
-            raw = resp.read().decode("utf-8", errors="replace")
-        try:
-            return json.loads(raw)
-        except Exception:
-            return {"ok": False, "error": "bad-json", "raw": raw}
-    except Exception as e:
-        if conf._shutdown_requested:
-            return {"ok": False, "error": "shutdown"}
-        return {"ok": False, "error": str(e)}
+# url -> (время получения, результат), общий для всех чатов
+_monitor_cache: Dict[str, Tuple[float, MonitorResult]] = {}
+_monitor_cache_lock = threading.Lock()
+# отдельная блокировка на URL: второй воркер ждёт первый запрос, а не дублирует его
+_monitor_url_locks: Dict[str, threading.Lock] = {}
+
+def _fresh_cached(url: str, ttl: float) -> Optional[MonitorResult]:
+    with _monitor_cache_lock:
+        cached = _monitor_cache.get(url)
+    if cached is not None and time.monotonic() - cached[0] < ttl:
+        return cached[1]
+    return None
+
+def cached_monitor(url: str, ttl: float) -> MonitorResult:
+    """monitor() с кешированием результата на ttl секунд. Пустой результат
+    не кешируется: monitor() возвращает его и при ошибке сети или разбора"""
+    cached = _fresh_cached(url, ttl)
+    if cached is not None:
+        return cached
+
+    with _monitor_cache_lock:
+        url_lock = _monitor_url_locks.setdefault(url, threading.Lock())
+    with url_lock:
+        cached = _fresh_cached(url, ttl)
+        if cached is not None:
+            return cached
+        result = monitor(url)
+        if result.count or result.titles:
+            with _monitor_cache_lock:
+                _monitor_cache[url] = (time.monotonic(), result)
+    return result
 
 def handle_update(state: BotState,
                   token: str,
@@ -128,18 +132,21 @@ def show_main_menu(token: str,
     }
     send_telegram_message(token, str(chat_id), "Выберите действие:", reply_markup=kb)
 
+_PERIOD_OPTIONS = [
+    ("Каждые 15 минут", 15 * 60),
+    ("Каждый час", 60 * 60),
+    ("Каждые 6 часов", 6 * 60 * 60),
+    ("Каждые 12 часов", 12 * 60 * 60),
+    ("Раз в сутки", 24 * 60 * 60),
+]
+# callback_data приходит от клиента и может быть подделан
+_ALLOWED_PERIODS = frozenset(sec for _, sec in _PERIOD_OPTIONS)
+
 def show_period_menu(token: str,
                      chat_id: int) -> None:
     """Показать меню выбора периода"""
-    options = [
-        ("Каждые 15 минут", 15 * 60),
-        ("Каждый час", 60 * 60),
-        ("Каждые 6 часов", 6 * 60 * 60),
-        ("Каждые 12 часов", 12 * 60 * 60),
-        ("Раз в сутки", 24 * 60 * 60),
-    ]
     rows = []
-    for text, sec in options:
+    for text, sec in _PERIOD_OPTIONS:
         rows.append([{ "text": text, "callback_data": f"period:{sec}" }])
     kb = {"inline_keyboard": rows}
     send_telegram_message(token, str(chat_id), "Выберите периодичность:", reply_markup=kb)
@@ -169,6 +176,8 @@ def on_callback(state: BotState,
         try:
             sec = int(data.split(":", 1)[1])
         except Exception:
+            sec = None
+        if sec not in _ALLOWED_PERIODS:
             send_telegram_message(token, str(chat_id), "Некорректный период.")
             return
             
@@ -176,7 +185,7 @@ def on_callback(state: BotState,
         with state.lock:
             state.subscribed_chat_ids.add(chat_id)
             state.chat_period_sec[chat_id] = sec
-            state.chat_next_run[chat_id] = now + sec
+            schedule_chat(state, chat_id, now + sec)
             
         save_state(state)
         send_telegram_message(token, str(chat_id), f"Готово. Буду присылать каждые {sec // 60} минут.")
@@ -194,6 +203,7 @@ def polling_loop(state: BotState,
                  token: str,
                  stop_event: threading.Event) -> None:
     """Цикл опроса Telegram API"""
+    backoff = 1.0
     while not stop_event.is_set() and not conf._shutdown_requested:
         params = {"timeout": 50}
         with state.lock:
@@ -201,9 +211,15 @@ def polling_loop(state: BotState,
                 params["offset"] = state.last_update_id + 1
 
         try:
-            data = telegram_api_call(token, "getUpdates", params=params, timeout=60)
+            # запас сверх timeout long-poll, чтобы не рвать соединение на пустом ответе
+            data = telegram_api_call(token, "getUpdates", params=params,
+                                     timeout=params["timeout"] + 10)
             if not isinstance(data, dict) or not data.get("ok"):
+                # экспоненциальная задержка со случайной добавкой, пока API недоступен
+                stop_event.wait(backoff + random.random() * 0.25)
+                backoff = min(backoff * 2, 60.0)
                 continue
+            backoff = 1.0
                 
             updates: List[Dict[str, Any]] = data.get("result") or []
             for upd in updates:
@@ -217,49 +233,98 @@ def polling_loop(state: BotState,
                 with state.lock:
                     state.last_update_id = upd_id
                 handle_update(state, token, upd)
-                
-            if updates:
-                save_state(state)
+
+            with state.lock:
+                last_update_id = state.last_update_id
+            if updates and last_update_id is not None:
+                journal_append(state, [{"op": "update_id", "id": last_update_id}])
                 
         except Exception as e:
             print(f"Polling error: {e}", file=sys.stderr)
+            stop_event.wait(backoff + random.random() * 0.25)
+            backoff = min(backoff * 2, 60.0)
+
+def _run_and_send(token: str,
+                  chat_ids: List[int],
+                  ttl: float) -> None:
+    """Собрать сводку и разослать ее чатам (выполняется в _EXEC)"""
+    try:
+        result = cached_monitor(AVITO_URL, ttl)
+        if conf._shutdown_requested:
+            return
+        msg = format_telegram_summary(result, AVITO_URL)
+    except Exception as e:
+        if not conf._shutdown_requested:
+            print(f"Scheduler error: {e}", file=sys.stderr)
+        return
+
+    for chat_id in chat_ids:
+        if conf._shutdown_requested:
+            break
+        try:
+            send_telegram_message(token, str(chat_id), msg)
+        except Exception as e:
+            if not conf._shutdown_requested:
+                print(f"Scheduler error: {e}", file=sys.stderr)
 
 def scheduler_loop(state: BotState,
                    token: str,
                    stop_event: threading.Event) -> None:
-    """Цикл планировщика для отправки уведомлений"""
+    """Цикл планировщика: только решает, кому пора отправлять, а сбор
+    сводки и отправку отдает в _EXEC"""
     while not stop_event.is_set() and not conf._shutdown_requested:
         now = time.monotonic()
-        try:
-            with state.lock:
-                items = list(state.chat_next_run.items())
-        except Exception:
-            items = []
-            
-        for chat_id, ts in items:
-            if stop_event.is_set() or conf._shutdown_requested:
+        due: List[int] = []
+        entries = []
+        with state.lock:
+            heap = state.chat_next_run_heap
+            while heap and heap[0][0] <= now:
+                ts, chat_id = heapq.heappop(heap)
+                # чат отписался или сменил период - запись устарела
+                if state.chat_next_run.get(chat_id) != ts:
+                    continue
+
+                # Запланировать следующий запуск от ожидаемого времени срабатывания,
+                # а не от текущего, чтобы время работы monitor() не копилось в дрейф
+                sec = state.chat_period_sec.get(chat_id, 15 * 60)
+                # файл состояния и журнал могут нести мусор: при sec <= 0
+                # next_fire не догнал бы now, а деление упало бы
+                if sec <= 0:
+                    sec = 15 * 60
+                next_fire = ts + sec
+                if next_fire <= now:
+                    # Пропущено несколько периодов - не отправляем их пачкой
+                    next_fire += ((now - next_fire) // sec + 1) * sec
+                schedule_chat(state, chat_id, next_fire)
+                due.append(chat_id)
+                entries.append({"op": "next_run", "chat": chat_id, "t": next_fire})
+            periods = list(state.chat_period_sec.values()) if due else []
+            # спим до ближайшего срабатывания; новые подписки будят через wakeup
+            timeout = heap[0][0] - now if heap else 60.0
+            state.wakeup.clear()
+
+        if due:
+            journal_append(state, entries)
+
+            # Сводка одинакова для всех чатов - собираем ее один раз за такт
+            ttl = min(periods, default=15 * 60) / 2
+            try:
+                _EXEC.submit(_run_and_send, token, due, ttl)
+            except RuntimeError:
+                # executor уже остановлен - идет завершение работы
                 break
-                
-            if now >= ts:
-                try:
-                    result = monitor(AVITO_URL)
-                    if conf._shutdown_requested:
-                        break
-                    msg = format_telegram_summary(result, AVITO_URL)
-                    send_telegram_message(token, str(chat_id), msg)
-                except Exception as e:
-                    if not conf._shutdown_requested:
-                        print(f"Scheduler error: {e}", file=sys.stderr)
-                        
-                # Запланировать следующий запуск
-                with state.lock:
-                    sec = state.chat_period_sec.get(chat_id, 15 * 60)
-                    state.chat_next_run[chat_id] = now + sec
-                    
-                if not conf._shutdown_requested:
-                    save_state(state)
-                    
-        stop_event.wait(1.0)
+
+        state.wakeup.wait(max(0.0, timeout))
+
+def _run_worker(loop, state: BotState, token: str,
+                stop_event: threading.Event) -> None:
+    """Запускает цикл потока и останавливает бота, если он завершился"""
+    try:
+        loop(state, token, stop_event)
+    finally:
+        if not stop_event.is_set():
+            print("One of the worker threads died, shutting down...", file=sys.stderr)
+            stop_event.set()
 
 def main() -> int:
     """Основная функция бота"""    
@@ -274,34 +339,36 @@ def main() -> int:
         return 1
 
     state = load_state()
-    stop_event = threading.Event()
+    # то же событие выставляет обработчик SIGINT/SIGTERM
+    stop_event = conf._shutdown_event
 
     # Запускаем потоки
-    poller = threading.Thread(target=polling_loop, args=(state, token, stop_event), daemon=True)
-    sched = threading.Thread(target=scheduler_loop, args=(state, token, stop_event), daemon=True)
+    poller = threading.Thread(target=_run_worker, args=(polling_loop, state, token, stop_event), daemon=True)
+    sched = threading.Thread(target=_run_worker, args=(scheduler_loop, state, token, stop_event), daemon=True)
 
     poller.start()
     sched.start()
+    flusher = start_state_flusher(state, stop_event)
 
     print("Бот запущен. Ожидаю команды /start в чате.")
     try:
-        while not conf._shutdown_requested:
-            # Проверяем, живы ли потоки
-            if not poller.is_alive() or not sched.is_alive():
-                print("One of the worker threads died, shutting down...", file=sys.stderr)
-                break
-                
+        stop_event.wait()
     except KeyboardInterrupt:
         print("Interrupted by user")
     finally:
         print("Остановка...")
         stop_event.set()
+        state.wakeup.set()
+        state.save_requested.set()
         
         # Даем потокам время на завершение
         poller.join(timeout=5)
         sched.join(timeout=5)
+        flusher.join(timeout=5)
+        _EXEC.shutdown(wait=False, cancel_futures=True)
         
-        save_state(state)
+        # финальная запись синхронно, даже если пришел SIGTERM
+        force_save_state(state)
         
     return 0
 
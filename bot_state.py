@@ -1,23 +1,41 @@
+import heapq
 import sys
 import threading
 
-from typing import Optional, Set, Dict, Any, List
-from dataclasses import dataclass
+from typing import Optional, Set, Dict, Any, List, Tuple
+from dataclasses import dataclass, field
 
-from conf import SUBSCRIPTIONS_FILE
-import conf
+from conf import (SUBSCRIPTIONS_FILE,
+                  SUBSCRIPTIONS_JOURNAL_FILE,
+                  STATE_SAVE_MIN_INTERVAL,
+                  JOURNAL_COMPACT_EVERY)
 
 from util import (_read_json_file,
                   _write_json_file,
+                  _append_json_lines,
+                  _read_json_lines,
+                  _truncate_file,
                   check_disk_space)
 
+# Порядок блокировок: сначала _journal_lock, потом state.lock
+_journal_lock = threading.Lock()
+
 @dataclass
 class BotState:
     subscribed_chat_ids: Set[int]
     chat_period_sec: Dict[int, int]
     chat_next_run: Dict[int, float]
     last_update_id: Optional[int]
-    lock: threading.Lock
+    lock: threading.RLock  # допускает вложенный save_state из-под блокировки
+    dirty: bool = False       # есть изменения, не записанные на диск
+    journal_entries: int = 0  # записей в журнале с последней записи файла
+    # (next_run, chat_id) в порядке срабатывания; chat_next_run остается
+    # источником истины, устаревшие записи отбрасываются при извлечении
+    chat_next_run_heap: List[Tuple[float, int]] = field(default_factory=list)
+    # будит планировщик, когда расписание изменилось
+    wakeup: threading.Event = field(default_factory=threading.Event)
+    # будит поток записи состояния (см. save_state)
+    save_requested: threading.Event = field(default_factory=threading.Event)
 
 def load_state() -> BotState:
     """Загрузка состояния с обработкой ошибок"""
@@ -27,8 +45,56 @@ def load_state() -> BotState:
         
     raw = _read_json_file(SUBSCRIPTIONS_FILE)
     if not raw:
-        return create_empty_state()
+        state = create_empty_state()
+        _replay_journal(state)
+        _rebuild_heap(state)
+        return state
+        
+    try:
+        # файл пишет save_state, так что обычно типы уже правильные
+        chats, periods, next_run, last_update_id = _parse_state_fast(raw)
+    except (KeyError, TypeError, ValueError, AttributeError):
+        chats, periods, next_run, last_update_id = _parse_state_checked(raw)
         
+    state = BotState(
+        subscribed_chat_ids=chats,
+        chat_period_sec=periods,
+        chat_next_run=next_run,
+        last_update_id=last_update_id,
+        lock=threading.RLock(),
+    )
+    _replay_journal(state)
+    _rebuild_heap(state)
+    return state
+
+def _parse_state_fast(raw: Dict[str, Any]) -> Tuple[Set[int], Dict[int, int], Dict[int, float], Optional[int]]:
+    """Разбор файла, записанного save_state: значения только приводятся к
+    нужным типам, любая ошибка уводит в _parse_state_checked. Словари по
+    чатам хранятся парами [chat_id, значение]; старый формат со строковыми
+    ключами тоже читается"""
+    chats = {int(v) for v in raw["subscribed_chat_ids"]}
+    periods = _pairs_to_dict(raw["chat_period_sec"], int)
+    next_run = _pairs_to_dict(raw["chat_next_run"], float)
+    last_update_id = raw["last_update_id"]
+    if last_update_id is not None:
+        last_update_id = int(last_update_id)
+    return chats, periods, next_run, last_update_id
+
+def _pairs_to_dict(value: Any, cast) -> Dict[int, Any]:
+    """Пары [chat_id, значение] (или старый словарь) -> словарь по chat_id"""
+    if isinstance(value, list):
+        return {int(k): cast(v) for k, v in value}
+    # формат до перехода на пары: {"chat_id": значение}
+    return {int(k): cast(v) for k, v in value.items()}
+
+def _iter_pairs(value: Any):
+    """Итерация по парам (chat_id, значение) в любом из двух форматов"""
+    if isinstance(value, list):
+        return value
+    return (value or {}).items()
+
+def _parse_state_checked(raw: Dict[str, Any]) -> Tuple[Set[int], Dict[int, int], Dict[int, float], Optional[int]]:
+    """Разбор файла с пропуском некорректных элементов (например, после ручной правки)"""
     chats = set()
     for v in raw.get("subscribed_chat_ids", []):
         try:
@@ -37,15 +103,17 @@ def load_state() -> BotState:
             continue
             
     periods = {}
-    for k, v in (raw.get("chat_period_sec") or {}).items():
+    for pair in _iter_pairs(raw.get("chat_period_sec")):
         try:
+            k, v = pair
             periods[int(k)] = int(v)
         except Exception:
             continue
             
     next_run = {}
-    for k, v in (raw.get("chat_next_run") or {}).items():
+    for pair in _iter_pairs(raw.get("chat_next_run")):
         try:
+            k, v = pair
             next_run[int(k)] = float(v)
         except Exception:
             continue
@@ -55,14 +123,44 @@ def load_state() -> BotState:
         last_update_id = int(last_update_id) if last_update_id is not None else None
     except Exception:
         last_update_id = None
-        
-    return BotState(
-        subscribed_chat_ids=chats,
-        chat_period_sec=periods,
-        chat_next_run=next_run,
-        last_update_id=last_update_id,
-        lock=threading.Lock(),
-    )
+
+    return chats, periods, next_run, last_update_id
+
+def _rebuild_heap(state: BotState) -> None:
+    """Строит кучу планировщика по chat_next_run. Список меняется на месте:
+    scheduler_loop держит ссылку на него в течение такта"""
+    heap = state.chat_next_run_heap
+    heap[:] = [(ts, chat_id) for chat_id, ts in state.chat_next_run.items()]
+    heapq.heapify(heap)
+
+def schedule_chat(state: BotState, chat_id: int, ts: float) -> None:
+    """Назначает следующий запуск для чата. Вызывать под state.lock"""
+    state.chat_next_run[chat_id] = ts
+    heapq.heappush(state.chat_next_run_heap, (ts, chat_id))
+    # смены периода и отписки оставляют в куче устаревшие записи;
+    # если их стало больше живых, проще пересобрать кучу целиком
+    if len(state.chat_next_run_heap) > 2 * len(state.chat_next_run) + 16:
+        _rebuild_heap(state)
+    state.wakeup.set()
+
+def _replay_journal(state: BotState) -> None:
+    """Применяет к загруженному состоянию изменения из журнала"""
+    entries = _read_json_lines(SUBSCRIPTIONS_JOURNAL_FILE)
+    for entry in entries:
+        try:
+            op = entry.get("op")
+            if op == "next_run":
+                chat_id = int(entry["chat"])
+                # чат мог отписаться уже после этой записи
+                if chat_id in state.chat_period_sec:
+                    state.chat_next_run[chat_id] = float(entry["t"])
+            elif op == "update_id":
+                upd_id = int(entry["id"])
+                if state.last_update_id is None or upd_id > state.last_update_id:
+                    state.last_update_id = upd_id
+        except Exception:
+            continue
+    state.journal_entries = len(entries)
 
 def create_empty_state() -> BotState:
     """Создает пустое состояние"""
@@ -71,20 +169,71 @@ def create_empty_state() -> BotState:
         chat_period_sec={},
         chat_next_run={},
         last_update_id=None,
-        lock=threading.Lock(),
+        lock=threading.RLock(),
     )
 
-def save_state(state: BotState) -> bool:
-    """Сохранение состояния с блокировкой"""
-    if conf._shutdown_requested:
-        return False
-        
+def save_state(state: BotState) -> None:
+    """Отложенное сохранение: помечает состояние измененным и будит поток
+    записи. Серия изменений подряд дает одну перезапись файла"""
     with state.lock:
-        data = {
-            "subscribed_chat_ids": sorted(list(state.subscribed_chat_ids)),
-            "chat_period_sec": {str(k): v for k, v in state.chat_period_sec.items()},
-            "chat_next_run": {str(k): v for k, v in state.chat_next_run.items()},
-            "last_update_id": state.last_update_id,
-        }
-    return _write_json_file(SUBSCRIPTIONS_FILE, data)
+        state.dirty = True
+        state.save_requested.set()
+
+def force_save_state(state: BotState) -> bool:
+    """Немедленное сохранение состояния, в том числе при завершении работы.
+    Заодно сбрасывает журнал: все его записи уже вошли в файл состояния"""
+    with _journal_lock:
+        # под блокировкой только копируем, сериализация и запись - без нее
+        with state.lock:
+            data = {
+                "subscribed_chat_ids": list(state.subscribed_chat_ids),
+                "chat_period_sec": list(state.chat_period_sec.items()),
+                "chat_next_run": list(state.chat_next_run.items()),
+                "last_update_id": state.last_update_id,
+            }
+            state.dirty = False
+        # после записи журнал обнуляется, поэтому файл должен быть на диске
+        ok = _write_json_file(SUBSCRIPTIONS_FILE, data, force=True, durable=True)
+        if ok:
+            _truncate_file(SUBSCRIPTIONS_JOURNAL_FILE)
+            with state.lock:
+                state.journal_entries = 0
+    if not ok:
+        with state.lock:
+            state.dirty = True
+    return ok
+
+def journal_append(state: BotState, entries: List[Dict[str, Any]]) -> None:
+    """Дозапись изменений часто меняющихся полей (chat_next_run, last_update_id)
+    вместо перезаписи всего файла. Вызывать без удержания state.lock"""
+    if not entries:
+        return
+    with _journal_lock:
+        ok = _append_json_lines(SUBSCRIPTIONS_JOURNAL_FILE, entries)
+        with state.lock:
+            if ok:
+                state.journal_entries += len(entries)
+            # не удалось дописать или журнал разросся - пора переписать файл целиком
+            if not ok or state.journal_entries >= JOURNAL_COMPACT_EVERY:
+                state.dirty = True
+                state.save_requested.set()
+
+def _flusher_loop(state: BotState, stop_event: threading.Event) -> None:
+    """Поток отложенной записи состояния"""
+    while not stop_event.is_set():
+        state.save_requested.wait()
+        # собираем серию изменений в одну запись
+        if stop_event.wait(STATE_SAVE_MIN_INTERVAL):
+            return
+        state.save_requested.clear()
+        with state.lock:
+            dirty = state.dirty
+        if dirty:
+            force_save_state(state)
 
+def start_state_flusher(state: BotState, stop_event: threading.Event) -> threading.Thread:
+    """Запускает поток, выполняющий запись после save_state. При остановке
+    нужно выставить state.save_requested, а потом вызвать force_save_state"""
+    flusher = threading.Thread(target=_flusher_loop, args=(state, stop_event), daemon=True)
+    flusher.start()
+    return flusher
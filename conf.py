@@ -1,7 +1,7 @@
 '''
-Module contains mostly immutable state, beside the only mutable flag that
-represents receiving signal to shutdown. This flag is placed here to prevent
-cyclic import.
+Module contains mostly immutable state, beside the only mutable flag (and
+the event mirroring it) that represents receiving signal to shutdown. This
+flag is placed here to prevent cyclic import.
 
 To represent existing state there are tags:
 - RaspberryPI constraints
@@ -24,20 +24,29 @@ import os
 import argparse
 import signal
 import sys
+import threading
 
 ## RaspberryPI constraints
 MAX_RESPONSE_SIZE = 5 * 1024 * 1024    # 5MB limit for HTML responses
 MIN_DISK_SPACE_MB = 10                 # Minimum free disk space required
 STATE_FILE_MAX_SIZE = 1 * 1024 * 1024  # 1MB max for state files
+STATE_SAVE_MIN_INTERVAL = 1.0          # Debounce window for state file rewrites
+SCHEDULER_WORKERS = 4                  # Threads sending scheduled summaries
+JOURNAL_COMPACT_EVERY = 500            # Journal entries before state file rewrite
 
 ##Mutable state
 _shutdown_requested = False # Global flag for graceful shutdown
+_shutdown_event = threading.Event() # Same flag for threads waiting on it
 
 
 ##Destinations
 #base url that is used to retrieve information about QAn
 AVITO_URL="https://career.avito.com/vacancies/razrabotka/?q=&action=filter&direction=razrabotka&tags%5B%5D=s26502"
 SUBSCRIPTIONS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot_subscriptions.json")
+#append-only log of hot fields changed since SUBSCRIPTIONS_FILE was written
+SUBSCRIPTIONS_JOURNAL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot_subscriptions.log")
+#ETag/Last-Modified of fetched pages with the last extracted result, used for conditional GET
+HTTP_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "http_cache.json")
 
 ## CLI arguments processing
 #TODO: add an ability to pass constans defined above as cli arguments. Keep defined values as default
@@ -51,6 +60,11 @@ _parser.add_argument(
 )
 
 
+_args_cache = None
+
 def get_args():
-    return _parser.parse_args()
+    global _args_cache
+    if _args_cache is None:
+        _args_cache = _parser.parse_args()
+    return _args_cache
 
@@ -3,107 +3,261 @@ import sys
 import json
 from html import unescape as html_unescape
 from html import escape as html_escape
-from typing import Optional, List
+from typing import Optional, List, Union
 
-from conf import _shutdown_requested
+from conf import MAX_RESPONSE_SIZE
+import conf
 from vacancy_scraper import VacancyHTMLParser
 
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except Exception:
+    LexborHTMLParser = None
+
 try:
     from bs4 import BeautifulSoup
 except Exception:
     BeautifulSoup = None
 
+try:
+    import soupsieve as sv
+except Exception:
+    sv = None
+
 try:
     import lxml.html as LH 
 except Exception:
     LH = None
 
-def extract_count_xpath(html: str) -> Optional[int]:
-    if LH is None:
-        return None
+try:
+    import orjson
+except Exception:
+    orjson = None  # type: ignore
+
+# страница приходит из fetch как bytes в UTF-8 (или уже как str, если
+# кодировка другая) и отдается парсерам без промежуточного decode
+Html = Union[str, bytes]
+
+# без явной кодировки libxml2 читает bytes без meta charset как latin-1
+_LXML_PARSER = LH.HTMLParser(encoding="utf-8") if LH is not None else None
+
+def _lxml_fromstring(html: Html):
+    return LH.fromstring(html, parser=_LXML_PARSER)
+
+def _as_text(html: Html) -> str:
+    """str для разборщиков, которые не принимают bytes"""
+    if isinstance(html, bytes):
+        return html.decode("utf-8", errors="replace")
+    return html
+
+def _contains(html: Html, needle: str) -> bool:
+    if isinstance(html, bytes):
+        return needle.encode("utf-8") in html
+    return needle in html
+
+# тексты ссылок навигации, которые тоже ведут в /vacancies/
+_BLACKLIST_TEXT = frozenset({"вакансии", "назад", "смотреть вакансии"})
+
+_VACANCIES_SEGMENT = "/vacancies/"
+
+_VACANCY_LINK_CSS = 'a[href*="/vacancies/"]'
+_VACANCY_LINK_XPATH = '//a[contains(@href, "/vacancies/")]'
+
+# селектор для BS4 компилируется один раз, а не в каждом soup.select
+_VACANCY_LINK_SEL = sv.compile(_VACANCY_LINK_CSS) if sv is not None else None
+
+_DIGITS_RE = re.compile(r"\d+")
+
+# счетчик вакансий: один и тот же элемент для lxml и для selectolax
+_COUNT_XPATH = "/html/body/main/div/div[2]/div/span"
+_COUNT_CSS = "html > body > main > div > div:nth-of-type(2) > div > span"
+
+# блок JSON-LD может дать название, только если в нем упоминается тип
+# job/vacancy и есть поле jobTitle/title; остальные (BreadcrumbList,
+# Organization и т.п.) не декодируются
+_JSONLD_JOB_HINT_RE = re.compile(r"job|vacancy", re.I)
+
+# ссылка на вакансию целиком, когда нет ни одного C-парсера: <a> не бывают
+# вложенными, так что текст ссылки - все до ближайшего </a>
+_VACANCY_ANCHOR_RE = re.compile(
+    r"""<a\b[^>]*?\bhref\s*=\s*["']([^"']*/vacancies/[^"']*)["'][^>]*>(.*?)</a\s*>""",
+    re.I | re.S,
+)
+_TAG_RE = re.compile(r"<[^>]+>")
+
+_JSONLD_RE = re.compile(
+    r"<script[^>]+type=\"application/ld\+json\"[^>]*>([\s\S]*?)</script>",
+    re.I,
+)
+
+def _unique_titles(titles: List[str]) -> List[str]:
+    """Дедупликация с сохранением порядка одним проходом на C. Названия
+    интернируются: от опроса к опросу они почти не меняются, и одинаковые
+    строки разных результатов - один объект с уже посчитанным хэшем"""
+    return list(dict.fromkeys(map(sys.intern, titles)))
+
+def parse_document(html: Html):
+    """Разбирает страницу один раз для всех извлекающих функций: дерево
+    selectolax (lexbor), если он установлен, иначе lxml-документ или None"""
     try:
-        doc = LH.fromstring(html)
-        nodes = doc.xpath('/html/body/main/div/div[2]/div/span')
-        if not nodes:
+        if LexborHTMLParser is not None:
+            return LexborHTMLParser(html)
+        if LH is not None:
+            return _lxml_fromstring(html)
+    except Exception as e:
+        print(f"Error in HTML parsing: {e}", file=sys.stderr)
+    return None
+
+def _is_lexbor_tree(tree) -> bool:
+    return LexborHTMLParser is not None and isinstance(tree, LexborHTMLParser)
+
+def extract_count_xpath(html: Html, tree=None) -> Optional[int]:
+    """Официальное число вакансий со страницы.
+    tree - результат parse_document, если он есть у вызывающего"""
+    if tree is None:
+        if LH is None:
+            return None
+        try:
+            tree = _lxml_fromstring(html)
+        except Exception:
             return None
-        text = nodes[0].text_content().strip()
-        m = re.search(r"\d+", text)
+    try:
+        if _is_lexbor_tree(tree):
+            node = tree.css_first(_COUNT_CSS)
+            if node is None:
+                return None
+            text = node.text(deep=True)
+        else:
+            nodes = tree.xpath(_COUNT_XPATH)
+            if not nodes:
+                return None
+            text = nodes[0].text_content()
+        m = _DIGITS_RE.search(text.strip())
         return int(m.group(0)) if m else None
     except Exception:
         return None
 
-def _is_probable_job_link(href: str, text: str, blacklist_text: set) -> bool:  # FIXED: Added blacklist_text parameter
+def _is_probable_job_link(href: str, text: str) -> bool:
     """Helper function to check if link is a job vacancy"""
-    if _shutdown_requested:
-        return False
-    txt = (text or "").strip().lower()
-    if not txt or txt in blacklist_text:
+    # флаг завершения проверяют циклы вызывающих функций; дешевые проверки
+    # идут первыми, casefold() - только для текста подходящей длины
+    if not text or "action=filter" in href:
         return False
-    if href.endswith("/vacancies") or href.endswith("/vacancies/"):
+    txt = text.strip()
+    if len(txt) < 5 or txt.casefold() in _BLACKLIST_TEXT:
         return False
-    if "action=filter" in href:
+    # после /vacancies/ должен быть хотя бы один непустой сегмент пути;
+    # проверяется поиском по строке, без split и промежуточных списков
+    i = href.find(_VACANCIES_SEGMENT)
+    if i < 0:
         return False
-    if len(txt) < 5:
-        return False
-    path = href.split("?")[0]
-    segments = [s for s in path.split("/") if s]
-    if "vacancies" in segments:
-        idx = segments.index("vacancies")
-        return len(segments) - (idx + 1) >= 1
-    return False
-
-def extract_vacancy_titles_bs4(html: str) -> List[str]:
-    """Извлекает названия вакансий через BeautifulSoup"""
-    if BeautifulSoup is None or _shutdown_requested:  # FIXED: Corrected condition
+    i += len(_VACANCIES_SEGMENT)
+    return i < len(href) and href[i] not in "/?#"
+
+def _iter_vacancy_anchors(html: Html, tree=None):
+    """Пары (href, текст) ссылок на /vacancies/: через selectolax (lexbor),
+    иначе XPath по дереву lxml, и только без обоих - через BeautifulSoup"""
+    if LexborHTMLParser is not None:
+        if not _is_lexbor_tree(tree):
+            tree = LexborHTMLParser(html)
+        for a in tree.css(_VACANCY_LINK_CSS):
+            text = " ".join(a.text(deep=True, separator=" ").split())
+            yield a.attributes.get("href") or "", text
+        return
+
+    if LH is not None:
+        # lxml напрямую: BeautifulSoup поверх него строил бы второе дерево
+        if tree is None:
+            tree = _lxml_fromstring(html)
+        for a in tree.xpath(_VACANCY_LINK_XPATH):
+            text = " ".join(" ".join(a.itertext()).split())
+            yield a.get("href") or "", text
+        return
+
+    if isinstance(html, bytes):
+        soup = BeautifulSoup(html, "html.parser", from_encoding="utf-8")
+    else:
+        soup = BeautifulSoup(html, "html.parser")
+    if _VACANCY_LINK_SEL is not None:
+        anchors = _VACANCY_LINK_SEL.select(soup)
+    else:
+        anchors = soup.select(_VACANCY_LINK_CSS)
+    for a in anchors:
+        yield a.get("href") or "", a.get_text(" ", strip=True)
+
+def extract_vacancy_titles_css(html: Html, tree=None) -> List[str]:
+    """Извлекает названия вакансий по CSS-селектору ссылок"""
+    if (LexborHTMLParser is None and LH is None and BeautifulSoup is None) or conf._shutdown_requested:
         return []
-        
+
     try:
-        soup = BeautifulSoup(html, "lxml") if LH is not None else BeautifulSoup(html, "html.parser")
-        anchors = soup.select('a[href*="/vacancies/"]')
-        blacklist_text = {"вакансии", "назад", "смотреть вакансии"}
-
-        seen: set[str] = set()
-        titles: List[str] = []
-        for a in anchors:
-            if _shutdown_requested:  # Check for shutdown during processing
+        candidates: List[str] = []
+        for href, text in _iter_vacancy_anchors(html, tree):
+            if conf._shutdown_requested:
                 break
-            href = a.get("href") or ""
-            text = a.get_text(" ", strip=True)
-            if _is_probable_job_link(href, text, blacklist_text):  # FIXED: Pass blacklist_text
-                if text not in seen:
-                    seen.add(text)
-                    titles.append(text)
-        return titles
-    
+            if _is_probable_job_link(href, text):
+                candidates.append(text)
+        return _unique_titles(candidates)
+
     except Exception as e:
-        print(f"Error in BS4 parsing: {e}", file=sys.stderr)
+        print(f"Error in HTML parsing: {e}", file=sys.stderr)
         return []
 
-def extract_vacancy_titles(html: str) -> List[str]:
-    """Извлекает названия вакансий с проверкой на shutdown"""
-    if _shutdown_requested:
-        return []
+def _iter_jsonld_scripts(html: Html, doc=None):
+    """Тексты <script type="application/ld+json">: из готового дерева
+    (selectolax или lxml), иначе регулярным выражением по исходному HTML"""
+    if _is_lexbor_tree(doc):
+        for script in doc.css('script[type="application/ld+json"]'):
+            yield script.text(deep=True) or ""
+        return
+    if doc is None and LH is not None:
+        try:
+            doc = _lxml_fromstring(html)
+        except Exception:
+            doc = None
+    if doc is not None:
+        for script in doc.iter("script"):
+            if script.get("type") == "application/ld+json":
+                yield script.text or ""
+        return
+    for m in _JSONLD_RE.finditer(_as_text(html)):
+        yield m.group(1)
 
-    # 1) Try BS4 first
-    bs4_titles = extract_vacancy_titles_bs4(html)
-    if bs4_titles:
-        return bs4_titles
+def extract_vacancy_titles_jsonld(html: Html, doc=None) -> List[str]:
+    """Извлекает названия вакансий из JSON-LD разметки (JobPosting).
+    doc - результат parse_document, если он есть у вызывающего"""
+    loads = orjson.loads if orjson is not None else json.loads
 
-    # 2) Try JSON-LD
-    seen_json = set()
-    json_titles: List[str] = []
-    for m in re.finditer(
-        r"<script[^>]+type=\"application/ld\+json\"[^>]*>([\s\S]*?)</script>",
-        html,
-        re.I,
-    ):
-        if _shutdown_requested:
+    bodies: List[str] = []
+    for script_text in _iter_jsonld_scripts(html, doc):
+        if conf._shutdown_requested:
             break
-        json_text = html_unescape(m.group(1)).strip()
-        try:
-            data = json.loads(json_text)
-        except Exception:
+        json_text = script_text.strip()
+        if "&" in json_text:
+            json_text = html_unescape(json_text)
+        if not json_text or ('"title"' not in json_text and '"jobTitle"' not in json_text):
             continue
+        if _JSONLD_JOB_HINT_RE.search(json_text) is None:
+            continue
+        bodies.append(json_text)
+
+    if not bodies:
+        return []
+
+    # все блоки разбираются одним вызовом как элементы общего массива;
+    # если какой-то блок битый, разбираем по одному и пропускаем его
+    try:
+        blocks = loads("[" + ",".join(bodies) + "]")
+    except Exception:
+        blocks = []
+        for json_text in bodies:
+            try:
+                blocks.append(loads(json_text))
+            except Exception:
+                continue
+
+    json_titles: List[str] = []
+    for data in blocks:
         items = data if isinstance(data, list) else [data]
         for item in items:
             if not isinstance(item, dict):
@@ -113,27 +267,78 @@ def extract_vacancy_titles(html: str) -> List[str]:
                 t = item.get("jobTitle") or item.get("title")
                 if isinstance(t, str):
                     tt = t.strip()
-                    if tt and tt not in seen_json:
+                    if tt:
                         json_titles.append(tt)
-                        seen_json.add(tt)
-    if json_titles:
-        return json_titles
+    return _unique_titles(json_titles)
 
-    # 3) Fallback to HTML parser
-    parser = VacancyHTMLParser()
-    parser.feed(html)
+def _extract_vacancy_titles_regex(html: str) -> List[str]:
+    """Названия вакансий одним проходом регулярного выражения по ссылкам"""
+    titles: List[str] = []
+    for m in _VACANCY_ANCHOR_RE.finditer(html):
+        if conf._shutdown_requested:
+            break
+        href = html_unescape(m.group(1))
+        text = " ".join(html_unescape(_TAG_RE.sub(" ", m.group(2))).split())
+        if _is_probable_job_link(href, text):
+            titles.append(text)
+    return _unique_titles(titles)
+
+def extract_vacancy_titles(html: Html, tree=None) -> List[str]:
+    """Извлекает названия вакансий с проверкой на shutdown.
+    tree - результат parse_document, если он есть у вызывающего"""
+    if conf._shutdown_requested:
+        return []
+
+    # пустая страница или ответ сверх лимита не разбираются вовсе
+    if not html or len(html) < 200 or len(html) > MAX_RESPONSE_SIZE:
+        return []
 
-    blacklist_text = {"вакансии", "назад", "смотреть вакансии"}
+    # JobPosting в JSON-LD точнее ссылок и не требует обхода всех <a>,
+    # поэтому если разметка есть на странице, она проверяется первой
+    json_titles: Optional[List[str]] = None
+    if _contains(html, "application/ld+json"):
+        json_titles = extract_vacancy_titles_jsonld(html, tree)
+        if json_titles:
+            return json_titles
+
+    # без ссылок на /vacancies/ разбирать дерево ради a[href] бессмысленно
+    if not _contains(html, "/vacancies/"):
+        return json_titles or []
+
+    # 1) Ссылки на вакансии через C-парсер (selectolax или lxml) либо BS4
+    css_titles = extract_vacancy_titles_css(html, tree)
+    if css_titles:
+        return css_titles
+
+    # selectolax и lxml видят те же ссылки, что и HTMLParser, поэтому он
+    # нужен, только если ни один из них не установлен
+    if LexborHTMLParser is not None or LH is not None:
+        return []
+
+    # 2) JSON-LD, если он еще не проверялся
+    if json_titles is None:
+        json_titles = extract_vacancy_titles_jsonld(html, tree)
+        if json_titles:
+            return json_titles
+
+    # 3) Регулярное выражение по ссылкам - всегда, когда нет ни selectolax,
+    # ни lxml, в том числе если BS4 установлен, но ничего не нашел
+    text_html = _as_text(html)
+    regex_titles = _extract_vacancy_titles_regex(text_html)
+    if regex_titles:
+        return regex_titles
+
+    # 4) Fallback to HTML parser
+    parser = VacancyHTMLParser()
+    parser.feed(text_html)
 
     filtered: List[str] = []
-    seen = set()
     for href, text in parser.items:
-        if _shutdown_requested:
+        if conf._shutdown_requested:
             break
-        if _is_probable_job_link(href, text, blacklist_text):  # FIXED: Use helper function
+        if _is_probable_job_link(href, text):  # FIXED: Use helper function
             t = text.strip()
-            if t and t not in seen:
+            if t:
                 filtered.append(t)
-                seen.add(t)
 
-    return filtered
+    return _unique_titles(filtered)
@@ -3,89 +3,104 @@
 Скрипт: мониторинг QA-вакансий на Avito Career и уведомление в Telegram.
 """
 
-import json
 import os
 import re
 import sys
+import threading
 
-from typing import List, Optional
+from typing import List, Optional, Dict, Any
 
 from conf import (MIN_DISK_SPACE_MB,
                   STATE_FILE_MAX_SIZE,
                   MAX_RESPONSE_SIZE,
                   AVITO_URL,
-                  _shutdown_requested,
+                  HTTP_CACHE_FILE,
                   get_args)
+import conf
 
 from util import (check_disk_space,
                   format_console_output,
-                  format_telegram_summary)
+                  format_telegram_summary,
+                  _read_json_file,
+                  _write_json_file)
 
 from extractor import (extract_count_xpath,
-                       extract_vacancy_titles_bs4,
-                       extract_vacancy_titles)
-
-from urllib.parse import urlencode
-from urllib.request import Request, urlopen
-from urllib.error import HTTPError, URLError
-from vacancy_scraper import MonitorResult, fetch_html
-
+                       extract_vacancy_titles,
+                       parse_document)
+
+from vacancy_scraper import MonitorResult, fetch_html_conditional
+from telegram_api import send_telegram_message
+
+
+# url -> {"etag", "last_modified", "titles", "count"}: валидаторы последнего
+# ответа и результат его разбора; читается с диска один раз за процесс
+_http_cache: Optional[Dict[str, Dict[str, Any]]] = None
+_http_cache_lock = threading.Lock()
+_http_cache_write_lock = threading.Lock()
+
+def _cached_page(url: str) -> Dict[str, Any]:
+    """Запись кэша условных запросов для url (пустая, если ее нет)"""
+    global _http_cache
+    with _http_cache_lock:
+        if _http_cache is None:
+            raw = _read_json_file(HTTP_CACHE_FILE)
+            _http_cache = raw if isinstance(raw, dict) else {}
+        entry = _http_cache.get(url)
+        return entry if isinstance(entry, dict) else {}
+
+def _remember_page(url: str, etag: Optional[str], last_modified: Optional[str], result: MonitorResult) -> None:
+    """Сохраняет валидаторы ответа вместе с результатом его разбора. Ответ
+    без валидаторов или без названий удаляет запись: иначе следующий 304
+    по старым валидаторам вернул бы названия с прежней страницы"""
+    # запись на диск - вне _http_cache_lock, чтобы не держать _cached_page
+    # других воркеров; отдельная блокировка сохраняет порядок записей
+    with _http_cache_write_lock:
+        with _http_cache_lock:
+            if _http_cache is None:
+                return
+            if (etag or last_modified) and result.titles:
+                _http_cache[url] = {
+                    "etag": etag,
+                    "last_modified": last_modified,
+                    "titles": result.titles,
+                    "count": result.count,
+                }
+            elif _http_cache.pop(url, None) is None:
+                return
+            data = dict(_http_cache)
+        _write_json_file(HTTP_CACHE_FILE, data)
 
 def monitor(url: str) -> MonitorResult:
     """Основная функция мониторинга с обработкой shutdown"""
-    if _shutdown_requested or not check_disk_space():
+    if conf._shutdown_requested or not check_disk_space():
         return MonitorResult(titles=[], count=0)
                 
     try:
-        html = fetch_html(url)
-        titles = extract_vacancy_titles(html)
-        official_count = extract_count_xpath(html)
+        cached = _cached_page(url)
+        if "titles" in cached:
+            html, etag, last_modified = fetch_html_conditional(
+                url, cached.get("etag"), cached.get("last_modified"))
+        else:
+            html, etag, last_modified = fetch_html_conditional(url)
+        if html is None:
+            # 304: страница не изменилась, разбирать нечего
+            return MonitorResult(titles=list(cached["titles"]), count=cached["count"])
+
+        # дерево строится один раз и для названий, и для счетчика
+        tree = parse_document(html)
+        titles = extract_vacancy_titles(html, tree)
+        official_count = extract_count_xpath(html, tree)
         count = official_count if isinstance(official_count, int) and official_count >= 0 else len(titles)
-        return MonitorResult(titles=titles, count=count)
+        result = MonitorResult(titles=titles, count=count)
+        _remember_page(url, etag, last_modified, result)
+        return result
     except InterruptedError:
         raise  # Re-raise shutdown signals
     except Exception as e:
-        if not _shutdown_requested:
+        if not conf._shutdown_requested:
             print(f"Monitoring error: {e}", file=sys.stderr)
         return MonitorResult(titles=[], count=0)
 
-def send_telegram_message(token: str, chat_id: str, text: str, reply_markup: Optional[dict] = None) -> bool:
-    """Отправка сообщения в Telegram с обработкой shutdown"""
-    if _shutdown_requested or not token or not chat_id:
-        return False
-        
-        
-    api_url = f"https://api.telegram.org/bot{token}/sendMessage"
-    payload = {
-        "chat_id": chat_id,
-        "text": text[:4000],
-        "parse_mode": "HTML",
-        "disable_web_page_preview": True,
-    }
-    if reply_markup is not None:
-        try:
-            payload["reply_markup"] = json.dumps(reply_markup, ensure_ascii=False)
-        except Exception:
-            pass
-            
-    data = urlencode(payload).encode("utf-8")
-    try:
-        req = Request(api_url, data=data, method="POST")
-        req.add_header("Content-Type", "application/x-www-form-urlencoded")
-        with urlopen(req, timeout=20) as resp:
-            return 200 <= resp.status < 300
-    except HTTPError as e:
-        if _shutdown_requested:
-            return False
-        # [existing error handling...]
-        return False
-    except Exception as e:
-        if _shutdown_requested:
-            return False
-        print(f"Telegram send error: {e}", file=sys.stderr)
-        return False
-
-
 def main() -> int:
     """Основная функция с улучшенной обработкой ошибок"""    
     args = get_args()
@@ -99,7 +114,7 @@ def main() -> int:
         # Текущий результат
         result = monitor(args.url)
         
-        if _shutdown_requested:
+        if conf._shutdown_requested:
             print("Shutdown requested, exiting early")
             return 130
 
@@ -107,7 +122,7 @@ def main() -> int:
         print(format_console_output(result))
 
         # Уведомления в Telegram
-        if not args.no_telegram and not _shutdown_requested:
+        if not args.no_telegram and not conf._shutdown_requested:
             token = os.getenv("TELEGRAM_BOT_TOKEN", "").strip()
             chat_id = os.getenv("TELEGRAM_CHAT_ID", "").strip()
             if token and chat_id:
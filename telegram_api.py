@@ -0,0 +1,164 @@
+'''
+This module is the only place that talks to Telegram Bot API. Both the bot
+and the one-shot script go through telegram_api_call, so connection pooling,
+timeouts and shutdown handling are implemented once.
+'''
+import json
+import sys
+
+from typing import Optional, Dict, Any, List
+
+import urllib3
+
+#orjson is optional, falls back to json
+try:
+    import orjson
+except Exception:
+    orjson = None  # type: ignore
+
+from conf import SCHEDULER_WORKERS
+import conf
+from vacancy_scraper import shared_ssl_context
+
+
+# Отдельные пулы соединений с api.telegram.org: getUpdates держит соединение
+# до 50 секунд, и отправка сообщений из планировщика не должна его ждать
+_TELEGRAM_HOST = "api.telegram.org"
+
+# Один SSLContext на оба пула и на запросы к Avito: CA-бандл разбирается
+# один раз за процесс, а не при каждом новом соединении
+_SSL_CTX = shared_ssl_context()
+
+_POLL_POOL = urllib3.HTTPSConnectionPool(
+    _TELEGRAM_HOST,
+    maxsize=2,
+    block=False,
+    ssl_context=_SSL_CTX,
+    headers={"Connection": "keep-alive"},
+    retries=urllib3.Retry(total=2, backoff_factor=0.2),
+)
+_API_POOL = urllib3.HTTPSConnectionPool(
+    _TELEGRAM_HOST,
+    maxsize=SCHEDULER_WORKERS + 2,  # воркеры планировщика + обработчики команд
+    block=False,
+    ssl_context=_SSL_CTX,
+    headers={"Connection": "keep-alive"},
+    retries=urllib3.Retry(total=2, backoff_factor=0.2),
+)
+
+# token -> "/bot<token>/", чтобы не собирать префикс на каждый вызов
+_API_BASES: Dict[str, str] = {}
+
+
+def telegram_api_call(token: str,
+                      method: str,
+                      params: Optional[Dict[str, Any]] = None,
+                      timeout: int = 60) -> Dict[str, Any]:
+    """Вызов Telegram Bot API с обработкой shutdown"""
+    if conf._shutdown_requested:
+        return {"ok": False, "error": "shutdown"}
+    
+    base = _API_BASES.get(token)
+    if base is None:
+        base = _API_BASES[token] = f"/bot{token}/"
+    path = base + method
+    http_timeout = urllib3.Timeout(connect=5.0, read=timeout)
+
+    try:
+        if method == "getUpdates":
+            resp = _POLL_POOL.request("GET", path, fields=params,
+                                      timeout=http_timeout)
+        elif params:
+            resp = _API_POOL.request("POST", path, fields=params,
+                                     encode_multipart=False,
+                                     timeout=http_timeout)
+        else:
+            resp = _API_POOL.request("GET", path, timeout=http_timeout)
+        try:
+            if orjson is not None:
+                return orjson.loads(resp.data)
+            return json.loads(resp.data)
+        except Exception:
+            return {"ok": False, "error": "bad-json",
+                    "raw": resp.data.decode("utf-8", errors="replace")}
+    except Exception as e:
+        if conf._shutdown_requested:
+            return {"ok": False, "error": "shutdown"}
+        return {"ok": False, "error": str(e)}
+
+# лимит Bot API - 4096 символов на сообщение, с запасом
+_MESSAGE_LIMIT = 4000
+
+def _safe_cut(line: str, limit: int) -> int:
+    """Позиция разреза не дальше limit, не попадающая внутрь тега или сущности"""
+    head = line[:limit]
+    cut = limit
+    lt = head.rfind("<")
+    if lt > head.rfind(">"):
+        cut = lt
+    amp = head.rfind("&")
+    if amp > head.rfind(";"):
+        cut = min(cut, amp)
+    # тег или сущность длиннее limit целиком не сохранить
+    return cut or limit
+
+def _split_message(text: str, limit: int = _MESSAGE_LIMIT) -> List[str]:
+    """Делит текст на части не длиннее limit по границам строк: в HTML-режиме
+    обрезка посреди строки может разорвать тег или сущность. Слишком длинная
+    строка режется на куски, но не внутри &...; и <...>"""
+    if len(text) <= limit:
+        return [text]
+    pieces: List[str] = []
+    for line in text.split("\n"):
+        while len(line) > limit:
+            cut = _safe_cut(line, limit)
+            pieces.append(line[:cut])
+            line = line[cut:]
+        pieces.append(line)
+    parts: List[str] = []
+    current: List[str] = []
+    size = 0
+    for line in pieces:
+        if current and size + 1 + len(line) > limit:
+            parts.append("\n".join(current))
+            current, size = [], 0
+        size += len(line) + (1 if current else 0)
+        current.append(line)
+    if current:
+        parts.append("\n".join(current))
+    return parts
+
+def send_telegram_message(token: str, chat_id: str, text: str, reply_markup: Optional[dict] = None) -> bool:
+    """Отправка сообщения в Telegram с обработкой shutdown. Длинный текст
+    уходит несколькими сообщениями через одно соединение пула; при ошибке
+    на очередной части возвращается False, но уже отправленные части
+    остаются у получателя"""
+    if conf._shutdown_requested or not token or not chat_id:
+        return False
+        
+    markup = None
+    if reply_markup is not None:
+        try:
+            markup = json.dumps(reply_markup, ensure_ascii=False)
+        except Exception:
+            pass
+
+    parts = _split_message(text)
+    for i, part in enumerate(parts):
+        payload = {
+            "chat_id": chat_id,
+            "text": part,
+            "parse_mode": "HTML",
+            "disable_web_page_preview": True,
+        }
+        # клавиатура - под последней частью
+        if markup is not None and i == len(parts) - 1:
+            payload["reply_markup"] = markup
+            
+        data = telegram_api_call(token, "sendMessage", params=payload, timeout=20)
+        if not data.get("ok"):
+            # ошибки транспорта, а не отказ самого API
+            if "error" in data and not conf._shutdown_requested:
+                print(f"Telegram send error: {data['error']}", file=sys.stderr)
+            return False
+    return True
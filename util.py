@@ -18,31 +18,64 @@ Module contains various helper functions separated by tags:
 import signal
 import os
 import sys
+import hashlib
 import json
+import mmap
 import shutil
+import threading
+import time
 
+from functools import lru_cache
 from html import escape as html_escape
 
+#orjson is optional, falls back to json
+try:
+    import orjson
+except Exception:
+    orjson = None  # type: ignore
+
 from conf import MIN_DISK_SPACE_MB, STATE_FILE_MAX_SIZE, SUBSCRIPTIONS_FILE
 import conf
 
 from vacancy_scraper import MonitorResult
 
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 
 
 ## system event handlers
 
+_SHUTDOWN_SIGNALS = {signal.SIGINT, signal.SIGTERM}
+
 def _shutdown_handler(signum, frame):
     """Handle shutdown signals gracefully"""
     conf._shutdown_requested = True
+    conf._shutdown_event.set()
     print(f"Received signal {signum}, shutting down gracefully...", file=sys.stderr)
     sys.exit(0)
+
+def _signal_wait_loop():
+    """Поток, принимающий SIGINT/SIGTERM через sigwait: вывод и установка
+    флагов идут в обычном потоке, а не в асинхронном обработчике сигнала"""
+    signum = signal.sigwait(_SHUTDOWN_SIGNALS)
+    conf._shutdown_requested = True
+    conf._shutdown_event.set()
+    print(f"Received signal {signum}, shutting down gracefully...", file=sys.stderr)
+    # повторный сигнал - завершение без ожидания потоков и финальной записи
+    signum = signal.sigwait(_SHUTDOWN_SIGNALS)
+    print(f"Received signal {signum} again, exiting immediately", file=sys.stderr)
+    os._exit(1)
     
 def register_signal_handlers():
     '''
-    Call this function whenever you need to gently react to system signals
+    Call this function whenever you need to gently react to system signals.
+    Must be called before any other thread is started: the signals are
+    blocked for the calling thread and inherited by the threads it starts
     '''
+    if hasattr(signal, "pthread_sigmask") and hasattr(signal, "sigwait"):
+        signal.pthread_sigmask(signal.SIG_BLOCK, _SHUTDOWN_SIGNALS)
+        threading.Thread(target=_signal_wait_loop, name="signals", daemon=True).start()
+        return
+    # без sigwait (Windows) - обычные обработчики
     signal.signal(signal.SIGINT, _shutdown_handler)  #handle ctrl+c
     signal.signal(signal.SIGTERM, _shutdown_handler) #signal sent by not user
 
@@ -61,11 +94,21 @@ def load_env_variables():
 
 
 ## space size checkers
+# (time.monotonic() проверки, свободно МБ): statvfs не чаще раза в _DISK_CHECK_TTL секунд
+_DISK_CHECK_TTL = 5.0
+_last_disk_check = [0.0, None]
+
 def check_disk_space(min_free_mb: int = MIN_DISK_SPACE_MB) -> bool:
     """Проверяет, достаточно ли свободного места на диске"""
+    now = time.monotonic()
+    checked_at, free_mb = _last_disk_check
+    if free_mb is not None and now - checked_at < _DISK_CHECK_TTL:
+        return free_mb >= min_free_mb
+
     try:
         total, used, free = shutil.disk_usage(os.path.dirname(os.path.abspath(__file__)))
         free_mb = free // (1024 * 1024)
+        _last_disk_check[:] = [now, free_mb]
         if free_mb < min_free_mb:
             print(f"Warning: Low disk space - {free_mb}MB free, need {min_free_mb}MB", 
                   file=sys.stderr)
@@ -78,13 +121,14 @@ def check_disk_space(min_free_mb: int = MIN_DISK_SPACE_MB) -> bool:
 def check_state_file_size() -> bool:
     """Проверяет размер файла состояния"""
     try:
-        if os.path.exists(SUBSCRIPTIONS_FILE):
-            size = os.path.getsize(SUBSCRIPTIONS_FILE)
-            if size > STATE_FILE_MAX_SIZE:
-                print(f"State file too large: {size} bytes", file=sys.stderr)
-                return False
+        # один stat вместо exists + getsize
+        size = os.stat(SUBSCRIPTIONS_FILE).st_size
+        if size > STATE_FILE_MAX_SIZE:
+            print(f"State file too large: {size} bytes", file=sys.stderr)
+            return False
         return True
     except Exception:
+        # в том числе FileNotFoundError: файла еще нет
         return True
 
 ## Info output
@@ -95,41 +139,101 @@ def format_console_output(result: MonitorResult) -> str:
     lines.extend(result.titles)
     return "\n".join(lines)
 
+@lru_cache(maxsize=64)
+def _escaped_url(url: str) -> str:
+    """URL подписки один и тот же от опроса к опросу, экранируется один раз"""
+    return html_escape(url)
+
 def format_telegram_summary(result: MonitorResult, url: str) -> str:
+    safe_url = _escaped_url(url)
     if result.count == 0:
         return (
             f"<b>Avito QA вакансии</b>\n"
             f"Вакансий нет\n"
-            f"Ссылка: {html_escape(url)}"
+            f"Ссылка: {safe_url}"
         )
-    safe_titles = [html_escape(t) for t in result.titles]
-    lines = [
+    return "\n".join((
         "<b>Avito QA вакансии</b>",
         f"Найдено вакансий: <b>{result.count}</b>",
-        *safe_titles,
-        f"Ссылка: {html_escape(url)}",
-    ]
-    return "\n".join(lines)
+        *map(html_escape, result.titles),
+        f"Ссылка: {safe_url}",
+    ))
 
 
 ## File I/O
+def _fsync_dir(path: str) -> None:
+    """fsync каталога, чтобы сам rename пережил потерю питания (только POSIX)"""
+    if os.name != "posix":
+        return
+    dfd = os.open(path or ".", os.O_RDONLY)
+    try:
+        os.fsync(dfd)
+    finally:
+        os.close(dfd)
+
+# path -> (sha256 содержимого, st_mtime_ns, st_size, durable) последней записи
+# или чтения: повторная запись тех же байтов в неизмененный файл пропускается
+_written_digests: Dict[str, Tuple[bytes, int, int, bool]] = {}
+
+def _remember_digest(path: str, digest: bytes, st: os.stat_result, durable: bool) -> None:
+    _written_digests[path] = (digest, st.st_mtime_ns, st.st_size, durable)
+
+def _is_unchanged(path: str, digest: bytes, durable: bool) -> bool:
+    """Файл на диске уже содержит эти байты (и не менялся с тех пор)"""
+    prev = _written_digests.get(path)
+    if prev is None or prev[0] != digest or (durable and not prev[3]):
+        return False
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return (st.st_mtime_ns, st.st_size) == prev[1:3]
+
 def _read_json_file(path: str) -> Optional[Dict[str, Any]]:
     """Чтение JSON файла с проверкой размера"""
-    if not check_disk_space() or not check_state_file_size():
+    if not check_disk_space():
         return None
         
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        # размер проверяется до чтения, по самому файлу
+        st = os.stat(path)
+        size = st.st_size
+        if size > STATE_FILE_MAX_SIZE:
+            print(f"State file too large: {size} bytes", file=sys.stderr)
+            return None
+        if size == 0:
+            return {}
+
+        with open(path, "rb") as f:
+            if orjson is not None:
+                # файл отображается в память и отдается orjson без копии в bytes
+                try:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        with memoryview(mm) as view:
+                            # файл, переживший перезапуск, уже на диске
+                            _remember_digest(path, hashlib.sha256(view).digest(), st, True)
+                            return orjson.loads(view)
+                except OSError:
+                    f.seek(0)
+                    raw = f.read()
+            else:
+                raw = f.read()
+            _remember_digest(path, hashlib.sha256(raw).digest(), st, True)
+            if orjson is not None:
+                return orjson.loads(raw)
+            return json.loads(raw)
     except FileNotFoundError:
         return None
     except Exception as e:
         print(f"Error reading {path}: {e}", file=sys.stderr)
         return None
 
-def _write_json_file(path: str, data: Dict[str, Any]) -> bool:
-    """Запись JSON файла с проверкой ресурсов"""
-    if conf._shutdown_requested:
+def _write_json_file(path: str, data: Dict[str, Any], force: bool = False, durable: bool = False) -> bool:
+    """Запись JSON файла с проверкой ресурсов. force - писать и после
+    запроса на завершение работы (финальное сохранение). durable - fsync
+    файла и каталога: без него tmp + rename защищает только от частично
+    записанного файла, но не от потери последней записи при отключении питания"""
+    if conf._shutdown_requested and not force:
         return False
         
     if not check_disk_space():
@@ -137,18 +241,94 @@ def _write_json_file(path: str, data: Dict[str, Any]) -> bool:
         return False
         
     try:
-        # Check if data would be too large
-        data_size = len(json.dumps(data, ensure_ascii=False))
-        if data_size > STATE_FILE_MAX_SIZE:
-            print(f"State data too large: {data_size} bytes", file=sys.stderr)
+        # сериализуем один раз: эти же байты проверяются и пишутся одним write.
+        # Файлы читает только сам бот, поэтому без отступов
+        if orjson is not None:
+            payload = orjson.dumps(data, option=orjson.OPT_SORT_KEYS)
+        else:
+            payload = json.dumps(data, ensure_ascii=False, sort_keys=True,
+                                 separators=(",", ":")).encode("utf-8")
+        if len(payload) > STATE_FILE_MAX_SIZE:
+            print(f"State data too large: {len(payload)} bytes", file=sys.stderr)
             return False
+
+        digest = hashlib.sha256(payload).digest()
+        if _is_unchanged(path, digest, durable):
+            return True
             
         tmp = path + ".tmp"
-        with open(tmp, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        with open(tmp, "wb") as f:
+            f.write(payload)
+            if durable:
+                # данные должны быть на диске до rename, иначе при потере
+                # питания можно получить пустой файл вместо старого состояния
+                f.flush()
+                os.fsync(f.fileno())
         os.replace(tmp, path)
+        if durable:
+            _fsync_dir(os.path.dirname(path))
+        _remember_digest(path, digest, os.stat(path), durable)
         return True
     except Exception as e:
         print(f"Error writing {path}: {e}", file=sys.stderr)
         return False
 
+
+# path -> fd, открытый один раз с O_APPEND
+_append_fds: Dict[str, int] = {}
+
+def _append_json_lines(path: str, items: List[Dict[str, Any]]) -> bool:
+    """Дозапись JSON-строк в конец файла одним write"""
+    if conf._shutdown_requested:
+        return False
+
+    try:
+        if orjson is not None:
+            payload = b"".join(orjson.dumps(item) + b"\n" for item in items)
+        else:
+            payload = "".join(json.dumps(item, ensure_ascii=False) + "\n" for item in items).encode("utf-8")
+
+        fd = _append_fds.get(path)
+        if fd is None:
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            _append_fds[path] = fd
+        os.write(fd, payload)
+        return True
+    except Exception as e:
+        print(f"Error appending to {path}: {e}", file=sys.stderr)
+        return False
+
+def _truncate_file(path: str) -> None:
+    """Обнуление файла, дописываемого через _append_json_lines"""
+    try:
+        fd = _append_fds.get(path)
+        if fd is not None:
+            os.ftruncate(fd, 0)
+        elif os.path.exists(path):
+            os.truncate(path, 0)
+    except Exception as e:
+        print(f"Error truncating {path}: {e}", file=sys.stderr)
+
+def _read_json_lines(path: str) -> List[Dict[str, Any]]:
+    """Чтение JSON-строк; битые строки (например, недописанная последняя) пропускаются"""
+    try:
+        if os.path.getsize(path) > STATE_FILE_MAX_SIZE:
+            print(f"Journal too large: {path}", file=sys.stderr)
+            return []
+        with open(path, "rb") as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return []
+    except Exception as e:
+        print(f"Error reading {path}: {e}", file=sys.stderr)
+        return []
+
+    items = []
+    for line in lines:
+        try:
+            item = orjson.loads(line) if orjson is not None else json.loads(line)
+        except Exception:
+            continue
+        if isinstance(item, dict):
+            items.append(item)
+    return items
@@ -6,19 +6,22 @@ page is loaded chunk by chunk.
 Also it contains the primary class that scrapes page and produces
 pairs of link and vacancy description.
 '''
+import codecs
 import ssl
 import re
 
-from typing import List, Optional
+from typing import List, Optional, Tuple, Union
 from dataclasses import dataclass
+from functools import lru_cache
 
 from html import escape as html_escape
 from html.parser import HTMLParser
 
 from urllib.parse import urlencode
-from urllib.request import Request, urlopen
 from urllib.error import HTTPError
 
+import urllib3
+
 from conf import MAX_RESPONSE_SIZE
 import conf
 
@@ -29,9 +32,53 @@ try:
 except Exception:
     certifi = None  # type: ignore
 
+_CHARSET_RE = re.compile(r"charset=([\w-]+)", re.I)
+# кодировка из <meta> в начале страницы, если ее нет в Content-Type;
+# ищется по сырым bytes, до какого-либо decode
+_META_CHARSET_RE = re.compile(rb"""<meta[^>]+charset=["']?([\w-]+)""", re.I)
+
+# схлопывание пробельных последовательностей одним проходом
+_WS_RE = re.compile(r"\s+")
+
+_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/126.0.0.0 Safari/537.36"
+    ),
+    "Connection": "keep-alive",
+    # urllib3 сам распаковывает тело при чтении; лимит размера проверяется
+    # уже по распакованным данным. br/zstd добавляются, только если
+    # установлены brotli/zstandard, иначе остаются gzip и deflate
+    "Accept-Encoding": urllib3.util.make_headers(accept_encoding=True)["accept-encoding"],
+}
 
-@dataclass
+@lru_cache(maxsize=None)
+def shared_ssl_context() -> ssl.SSLContext:
+    """Один SSLContext на процесс для Avito и Telegram: CA-бандл certifi
+    разбирается один раз, а не для каждого пула"""
+    try:
+        if certifi is not None:
+            return ssl.create_default_context(cafile=certifi.where())
+    except Exception:
+        pass
+    return ssl.create_default_context()
+
+# Пул соединений к Avito: повторные мониторинги (по расписанию и из разных
+# чатов) переиспользуют TCP+TLS соединение вместо нового рукопожатия
+_HTTP = urllib3.PoolManager(
+    num_pools=2,
+    maxsize=conf.SCHEDULER_WORKERS,
+    block=False,
+    ssl_context=shared_ssl_context(),
+    headers=_HEADERS,
+)
+
+
+@dataclass(frozen=True)
 class MonitorResult:
+    # __slots__ вручную, а не slots=True: тот появился только в Python 3.10
+    __slots__ = ("titles", "count")
     titles: List[str]
     count: int
 
@@ -47,8 +94,13 @@ class VacancyHTMLParser(HTMLParser):
 
     def handle_starttag(self, tag, attrs):
         if tag == "a":
-            href = dict(attrs).get("href", "")
-            if "/vacancies/" in href:
+            # href ищется проходом по парам, без словаря на каждый тег
+            href = ""
+            for name, value in attrs:
+                if name == "href":
+                    href = value or ""
+                    break
+            if href and "/vacancies/" in href:
                 self._inside_relevant_anchor = True
                 self._anchor_nesting = 1
                 self._current_text_chunks = []
@@ -61,7 +113,7 @@ class VacancyHTMLParser(HTMLParser):
         if self._inside_relevant_anchor:
             self._anchor_nesting -= 1
             if tag == "a" and self._anchor_nesting <= 0:
-                text = " ".join(" ".join(self._current_text_chunks).split())
+                text = _WS_RE.sub(" ", " ".join(self._current_text_chunks)).strip()
                 if text:
                     self.items.append((self._current_href, text))
                 self._inside_relevant_anchor = False
@@ -76,60 +128,91 @@ class VacancyHTMLParser(HTMLParser):
 
 def fetch_html(url: str, timeout: int = 25) -> str:
     """Загружает HTML с ограничением размера"""
+    html, _, _ = fetch_html_conditional(url, timeout=timeout)
+    if isinstance(html, bytes):
+        return html.decode("utf-8", errors="replace")
+    return html or ""
+
+def fetch_html_conditional(url: str,
+                           etag: Optional[str] = None,
+                           last_modified: Optional[str] = None,
+                           timeout: int = 25) -> Tuple[Optional[Union[str, bytes]], Optional[str], Optional[str]]:
+    """Условный GET: (html, etag, last_modified). Если страница не изменилась
+    с переданных валидаторов (304), вместо html возвращается None.
+    Страница в UTF-8 возвращается как есть в bytes - парсеры декодируют ее
+    сами; в другой кодировке декодируется здесь же в str"""
     if conf._shutdown_requested:
         raise InterruptedError("Shutdown requested")
-        
-    headers = {
-        "User-Agent": (
-            "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/126.0.0.0 Safari/537.36"
-        )
-    }
-    req = Request(url, headers=headers)
-    
-    # SSL context with size limits
-    context = None
-    try:
-        if certifi is not None:
-            context = ssl.create_default_context(cafile=certifi.where())
-    except Exception:
-        context = None
+
+    headers = None
+    if etag or last_modified:
+        # заголовки запроса заменяют заголовки пула, а не дополняют их
+        headers = dict(_HEADERS)
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
         
     try:
-        with urlopen(req, timeout=timeout, context=context) as resp:
+        resp = _HTTP.request(
+            "GET", url,
+            headers=headers,
+            timeout=urllib3.Timeout(connect=10.0, read=timeout),
+            preload_content=False,
+        )
+        try:
+            if resp.status == 304:
+                return None, etag, last_modified
+            if resp.status >= 400:
+                raise HTTPError(url, resp.status, resp.reason, resp.headers, None)
+
             # Check Content-Length header first
             content_length = resp.headers.get('Content-Length')
             if content_length and int(content_length) > MAX_RESPONSE_SIZE:
                 raise ValueError(f"Response too large: {content_length} bytes")
                 
-            # Read in chunks with size limit
-            chunks = []
-            total_size = 0
-            while True:
-                if conf._shutdown_requested:
-                    raise InterruptedError("Shutdown requested")
-                    
-                chunk = resp.read(8192)  # 8KB chunks
-                if not chunk:
-                    break
-                    
-                total_size += len(chunk)
-                if total_size > MAX_RESPONSE_SIZE:
-                    raise ValueError(f"Response exceeds size limit: {total_size} > {MAX_RESPONSE_SIZE}")
-                    
-                chunks.append(chunk)
-                
-            content = b''.join(chunks)
+            if conf._shutdown_requested:
+                raise InterruptedError("Shutdown requested")
+
+            # Тело читается одним вызовом: при известной длине несжатого
+            # ответа - целиком, иначе не более лимита плюс один байт, чтобы
+            # заметить превышение (и не распаковывать gzip-бомбу до конца:
+            # read(amt) ограничивает распакованный объем с urllib3 2.6.0)
+            if content_length and not resp.headers.get("Content-Encoding"):
+                content = resp.read()
+            else:
+                content = resp.read(MAX_RESPONSE_SIZE + 1)
+            if len(content) > MAX_RESPONSE_SIZE:
+                raise ValueError(f"Response exceeds size limit: {len(content)} > {MAX_RESPONSE_SIZE}")
             
             # Decode with proper charset
             content_type = resp.headers.get("Content-Type", "")
             charset = "utf-8"
-            m = re.search(r"charset=([\w-]+)", content_type, re.I)
+            m = _CHARSET_RE.search(content_type)
             if m:
-                charset = m.group(1)
+                charset = m.group(1).lower()
+            else:
+                m = _META_CHARSET_RE.search(content, 0, 2048)
+                if m:
+                    charset = m.group(1).decode("ascii").lower()
+            try:
+                charset = codecs.lookup(charset).name
+            except LookupError:
+                # неизвестная Python кодировка (x-user-defined, опечатка) - как utf-8
+                charset = "utf-8"
+            html: Union[str, bytes] = content
+            if charset != "utf-8":
+                html = content.decode(charset, errors="replace")
                 
-            return content.decode(charset, errors="replace")
+            return (html,
+                    resp.headers.get("ETag"),
+                    resp.headers.get("Last-Modified"))
+        except BaseException:
+            # недочитанный ответ нельзя оставлять в соединении из пула
+            resp.close()
+            raise
+        finally:
+            resp.release_conn()
             
     except Exception as e:
         if conf._shutdown_requested: